@@ -18,11 +18,18 @@
 
 import os
 import sys
+import time
+import heapq
 import shutil
 import logging
 import datetime
+import threading
 from optparse import OptionParser
-from collections import OrderedDict
+from collections import OrderedDict, deque
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 try:
     import json
 except:
@@ -131,6 +138,26 @@ def parse_tiering_policies(tiering_policies_str, tiering_policies, error_msg):
     return True
 
 
+def rank_entry(path, dir_stats, policy):
+    entry = OrderedDict()
+    entry[PATH] = path
+    entry[SIZE] = size_to_str(dir_stats[SIZE])
+    key = "%s#%s" % (SIZE, VALID_SIZE_STR)
+    entry[key] = size_to_str(dir_stats[key])
+    key = "%s#%s#%s#%s" % (policy[1], policy[0], SIZE, VALID_SIZE_STR)
+    entry[key] = size_to_str(dir_stats[key])
+    key = "%s#%s#%s#%s" % (policy[1], policy[0], SIZE_RATIO, VALID_SIZE_STR)
+    entry[key] = ratio_to_str(dir_stats[key])
+    entry[COUNT] = count_to_str(dir_stats[COUNT])
+    key = "%s#%s" % (COUNT, VALID_SIZE_STR)
+    entry[key] = count_to_str(dir_stats[key])
+    key = "%s#%s#%s#%s" % (policy[1], policy[0], COUNT, VALID_SIZE_STR)
+    entry[key] = count_to_str(dir_stats[key])
+    key = "%s#%s#%s#%s" % (policy[1], policy[0], COUNT_RATIO, VALID_SIZE_STR)
+    entry[key] = ratio_to_str(dir_stats[key])
+    return entry
+
+
 def rank_dir_stats(all_level_stats, top_n=2, sort_key=SIZE):
     result = OrderedDict()
     for l in all_level_stats.keys():
@@ -150,30 +177,99 @@ def rank_dir_stats(all_level_stats, top_n=2, sort_key=SIZE):
                 if (not level in result):
                     result[level] = OrderedDict()
                 rkey = "Rank#%s#%s#%s" % (str(i), policy[1], policy[0])
-                result[level][rkey] = OrderedDict()
-                result[level][rkey][PATH] = path
-                result[level][rkey][SIZE] = size_to_str(ordered[path][SIZE])
-                key = "%s#%s" % (SIZE, VALID_SIZE_STR)
-                result[level][rkey][key] = size_to_str(ordered[path][key])
-                key = "%s#%s#%s#%s" % (
-                    policy[1], policy[0], SIZE, VALID_SIZE_STR)
-                result[level][rkey][key] = size_to_str(ordered[path][key])
-                key = "%s#%s#%s#%s" % (
-                    policy[1], policy[0], SIZE_RATIO, VALID_SIZE_STR)
-                result[level][rkey][key] = ratio_to_str(ordered[path][key])
-                result[level][rkey][COUNT] = count_to_str(ordered[path][COUNT])
-                key = "%s#%s" % (COUNT, VALID_SIZE_STR)
-                result[level][rkey][key] = count_to_str(ordered[path][key])
-                key = "%s#%s#%s#%s" % (
-                    policy[1], policy[0], COUNT, VALID_SIZE_STR)
-                result[level][rkey][key] = count_to_str(ordered[path][key])
-                key = "%s#%s#%s#%s" % (
-                    policy[1], policy[0], COUNT_RATIO, VALID_SIZE_STR)
-                result[level][rkey][key] = ratio_to_str(ordered[path][key])
+                result[level][rkey] = rank_entry(path, ordered[path], policy)
                 i = i + 1
                 logging.debug("i:%d, level:%s, rkey:%s, result[level][rkey]:%s" % (
                     i, level, rkey, result[level][rkey]))
-    return json.dumps(result, indent=4)
+    return result
+
+
+class RankSnapshotWriter(object):
+    """Keep a bounded min-heap of the top_n finished directories for every
+    (root, level, policy), and periodically dump them to snapshot_file in the
+    same shape as the final rank, so the leaders can be watched during a long
+    scan.
+    """
+
+    def __init__(self, snapshot_file, interval, top_n=2, sort_key=SIZE):
+        self.snapshot_file = snapshot_file
+        self.interval = interval
+        self.top_n = top_n
+        self.keys = ["%s#%s#%s#%s" % (policy[1], policy[0], sort_key, VALID_SIZE_STR)
+                     for policy in tiering_policies]
+        self.roots = []
+        self.heaps = {}
+        self.seq = 0
+        self.scanned = 0
+        self.completeness = 0.0
+        self.start_time = time.time()
+        self.last_write = self.start_time
+
+    def add_root(self, root):
+        self.roots.append(root)
+
+    def add_dir(self, root, level, path, dir_stats):
+        if (self.top_n <= 0):
+            return
+        for i in range(len(tiering_policies)):
+            heap = self.heaps.setdefault((root, level, i), [])
+            # seq breaks ties so that the stats dicts are never compared
+            item = (dir_stats[self.keys[i]], self.seq, path, dir_stats)
+            if (len(heap) < self.top_n):
+                heapq.heappush(heap, item)
+            elif (item[0] > heap[0][0]):
+                heapq.heapreplace(heap, item)
+        self.seq = self.seq + 1
+
+    def add_progress(self, scanned, done_weight):
+        self.scanned = self.scanned + scanned
+        self.completeness = self.completeness + done_weight
+        now = time.time()
+        if (now - self.last_write >= self.interval):
+            self.last_write = now
+            self.write()
+
+    def root_snapshot(self, root):
+        result = OrderedDict()
+        for level in sorted(set(l for (r, l, i) in self.heaps.keys() if r == root)):
+            lkey = "level-%d" % level
+            for i in range(len(tiering_policies)):
+                policy = tiering_policies[i]
+                ordered = sorted(self.heaps.get((root, level, i), []),
+                                 key=lambda x: (-x[0], x[1]))
+                for rank in range(len(ordered)):
+                    if (not lkey in result):
+                        result[lkey] = OrderedDict()
+                    rkey = "Rank#%s#%s#%s" % (str(rank), policy[1], policy[0])
+                    result[lkey][rkey] = rank_entry(
+                        ordered[rank][2], ordered[rank][3], policy)
+        return result
+
+    def snapshot(self):
+        if (len(self.roots) == 1):
+            result = self.root_snapshot(self.roots[0])
+        else:
+            result = OrderedDict()
+            for root in self.roots:
+                result[root] = self.root_snapshot(root)
+        # every root weighs 1.0 once fully scanned
+        completeness = get_ratio(self.completeness, len(self.roots))
+        progress = OrderedDict()
+        progress["Completeness"] = ratio_to_str(min(completeness, 1.0))
+        progress[COUNT] = count_to_str(self.scanned)
+        progress["ElapsedSeconds"] = int(time.time() - self.start_time)
+        result["Progress"] = progress
+        return result
+
+    def write(self):
+        tmp_file = "%s.tmp" % self.snapshot_file
+        try:
+            f = open(tmp_file, "w")
+            f.write(json.dumps(self.snapshot(), indent=4))
+            f.close()
+            replace_file(tmp_file, self.snapshot_file)
+        except (IOError, OSError):
+            logging.error("write snapshot %s failed" % self.snapshot_file)
 
 
 def init_dir_stats():
@@ -220,6 +316,16 @@ def get_parent_path(curr_path):
     return os.path.abspath(os.path.join(curr_path, os.pardir))
 
 
+def replace_file(src, dst):
+    if (hasattr(os, "replace")):
+        os.replace(src, dst)
+    else:
+        # python2 has no os.replace, and os.rename on windows refuses to overwrite
+        if (os.name == "nt" and os.path.exists(dst)):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
 def is_timestamp_cold(timestamp, days_to_cold):
     cold_time = datetime.datetime.now() - datetime.timedelta(days=days_to_cold)
     cold_timestamp = (
@@ -239,145 +345,247 @@ def get_ratio(dividend, divisor):
         return 0
 
 
-def get_volume_cold_ratio_rank(target_dir, tiering_policies, dir_levels=3, top_n=2, sort_key=SIZE):
-    target_dir_stats = init_dir_stats()
+def add_entry_stat(dir_stats, stat):
+    size = stat.st_size
+    mtime = stat.st_mtime
+    atime = stat.st_atime
+    dir_stats[COUNT] = dir_stats[COUNT] + 1
+    dir_stats[SIZE] = dir_stats[SIZE] + size
+    if (size >= VALID_SIZE):
+        key = "%s#%s" % (COUNT, VALID_SIZE_STR)
+        dir_stats[key] = dir_stats[key] + 1
+        key = "%s#%s" % (SIZE, VALID_SIZE_STR)
+        dir_stats[key] = dir_stats[key] + size
+        for policy in tiering_policies:
+            if ((policy[1] == MTIME and is_timestamp_cold(mtime, int(policy[0])))
+                    or (policy[1] == ATIME and is_timestamp_cold(atime, int(policy[0])))):
+                key = "%s#%s#%s#%s" % (
+                    policy[1], policy[0], COUNT, VALID_SIZE_STR)
+                dir_stats[key] = dir_stats[key] + 1
+                key = "%s#%s#%s#%s" % (
+                    policy[1], policy[0], SIZE, VALID_SIZE_STR)
+                dir_stats[key] = dir_stats[key] + size
 
-    # use dfs stack to get all stats
-    all_level_stats = {1: {target_dir: target_dir_stats}}
-    # (start_dir_level, start_path, phase). Phase1: expanding. Phase2: collecting stats
-    st = [(1, target_dir, 1)]
 
-    while (len(st) > 0):
-        (curr_level, curr_path, curr_phase) = st.pop()
-        logging.debug("curr_level: %s, curr_path: %s, curr_phase: %s" %
-                      (curr_level, curr_path, curr_phase))
+def set_dir_ratios(dir_stats):
+    dir_stats["%s#%s" % (COUNT_RATIO, VALID_SIZE_STR)] = get_ratio(
+        dir_stats["%s#%s" % (COUNT, VALID_SIZE_STR)], dir_stats[COUNT])
+    dir_stats["%s#%s" % (SIZE_RATIO, VALID_SIZE_STR)] = get_ratio(
+        dir_stats["%s#%s" % (SIZE, VALID_SIZE_STR)], dir_stats[SIZE])
+    for policy in tiering_policies:
+        dir_stats["%s#%s#%s#%s" % (policy[1], policy[0], COUNT_RATIO, VALID_SIZE_STR)] = get_ratio(
+            dir_stats["%s#%s#%s#%s" % (policy[1], policy[0], COUNT, VALID_SIZE_STR)], dir_stats["%s#%s" % (COUNT, VALID_SIZE_STR)])
+        dir_stats["%s#%s#%s#%s" % (policy[1], policy[0], SIZE_RATIO, VALID_SIZE_STR)] = get_ratio(
+            dir_stats["%s#%s#%s#%s" % (policy[1], policy[0], SIZE, VALID_SIZE_STR)], dir_stats["%s#%s" % (SIZE, VALID_SIZE_STR)])
+
+
+def collect_tree_stats(top_path, dir_stats):
+    """Add every entry under top_path (itself included) into dir_stats.
+    Return the number of entries scanned.
+    """
+    scanned = 0
+    # use bfs queue to collect stats > dir_levels
+    q = deque([top_path])
+    while (len(q) > 0):
+        curr_path = q.popleft()
+        scanned = scanned + 1
+        try:
+            stat = os.stat(curr_path)
+        except:
+            logging.error("os.stat(%s) failed" % curr_path)
+            continue
+        add_entry_stat(dir_stats, stat)
 
-        if (curr_level < dir_levels and curr_phase == 1):
-            if (not curr_level in all_level_stats):
-                all_level_stats[curr_level] = {}
-            all_level_stats[curr_level][curr_path] = init_dir_stats()
-            st.append((curr_level, curr_path, 2))
-            new_level = curr_level + 1
-            if (not os.path.isdir(curr_path)):
+        if (not os.path.isdir(curr_path)):
+            continue
+        try:
+            children = os.listdir(curr_path)
+            for child in children:
+                q.append(os.path.join(curr_path, child))
+        except:
+            logging.error("os.listdir(%s)" % curr_path)
+    return scanned
+
+
+class VolumeScan(object):
+    """Scan state of one target_dir.
+
+    The directories above dir_levels are expanded by the main thread. Every
+    entry at dir_levels is a unit whose whole tree is collected by a worker of
+    the shared ScanPool, at most max_workers units of the volume at a time.
+    A directory is finished once all its children are, and is then added to
+    its parent.
+    """
+
+    def __init__(self, target_dir, dir_levels, max_workers, snapshot_writer=None):
+        self.target_dir = target_dir
+        self.dir_levels = dir_levels
+        self.max_workers = max_workers
+        self.snapshot_writer = snapshot_writer
+        self.all_level_stats = {1: {}}
+        self.parents = {}
+        # number of unfinished children of the directories above dir_levels
+        self.pending = {}
+        # (level, path, dir_stats, weight) waiting for a worker
+        self.units = deque()
+        self.running = 0
+        self.finished = False
+        if (snapshot_writer is not None):
+            snapshot_writer.add_root(target_dir)
+
+    def expand(self):
+        # (level, path, parent_path, weight). weight is the share of the whole
+        # tree the entry stands for, split evenly among the children of a
+        # directory, used to estimate completeness
+        st = [(1, self.target_dir, None, 1.0)]
+        while (len(st) > 0):
+            (curr_level, curr_path, parent_path, curr_weight) = st.pop()
+            logging.debug("curr_level: %s, curr_path: %s" % (curr_level, curr_path))
+            if (not curr_level in self.all_level_stats):
+                self.all_level_stats[curr_level] = {}
+            dir_stats = init_dir_stats()
+            self.all_level_stats[curr_level][curr_path] = dir_stats
+            self.parents[curr_path] = parent_path
+
+            if (curr_level >= self.dir_levels):
+                self.units.append((curr_level, curr_path, dir_stats, curr_weight))
                 continue
+
             try:
-                children = os.listdir(curr_path)
-                for child in children:
-                    new_path = os.path.join(curr_path, child)
-                    if (not new_level in all_level_stats):
-                        all_level_stats[new_level] = {}
-                    st.append((new_level, new_path, 1))
+                add_entry_stat(dir_stats, os.stat(curr_path))
             except:
-                logging.error("os.listdir(%s) failed" % curr_path)
-
-        if (curr_level >= dir_levels and curr_phase == 1):
-            if (not curr_level in all_level_stats):
-                all_level_stats[curr_level] = {}
-            all_level_stats[curr_level][curr_path] = init_dir_stats()
-            # use bfs queue to collect stats > dir_levels
-            q = [curr_path]
-            while (len(q) > 0):
-                curr_path2 = q.pop(0)
-                try:
-                    stat = os.stat(curr_path2)
-                except:
-                    logging.error("os.stat(%s) failed" % curr_path2)
-                    continue
-                size = stat.st_size
-                mtime = stat.st_mtime
-                atime = stat.st_atime
-                all_level_stats[curr_level][curr_path][COUNT] = all_level_stats[curr_level][curr_path][COUNT] + 1
-                all_level_stats[curr_level][curr_path][SIZE] = all_level_stats[curr_level][curr_path][SIZE] + size
-                if (size >= VALID_SIZE):
-                    key = "%s#%s" % (COUNT, VALID_SIZE_STR)
-                    all_level_stats[curr_level][curr_path][key] = all_level_stats[curr_level][curr_path][key] + 1
-                    key = "%s#%s" % (SIZE, VALID_SIZE_STR)
-                    all_level_stats[curr_level][curr_path][key] = all_level_stats[curr_level][curr_path][key] + size
-                    for policy in tiering_policies:
-                        if ((policy[1] == MTIME and is_timestamp_cold(mtime, int(policy[0])))
-                                or (policy[1] == ATIME and is_timestamp_cold(atime, int(policy[0])))):
-                            key = "%s#%s#%s#%s" % (
-                                policy[1], policy[0], COUNT, VALID_SIZE_STR)
-                            all_level_stats[curr_level][curr_path][key] = all_level_stats[curr_level][curr_path][key] + 1
-                            key = "%s#%s#%s#%s" % (
-                                policy[1], policy[0], SIZE, VALID_SIZE_STR)
-                            all_level_stats[curr_level][curr_path][key] = all_level_stats[curr_level][curr_path][key] + size
-
-                if (not os.path.isdir(curr_path2)):
-                    continue
+                logging.error("os.stat(%s) failed" % curr_path)
+            children = []
+            if (os.path.isdir(curr_path)):
                 try:
-                    children = os.listdir(curr_path2)
-                    for child in children:
-                        new_path2 = os.path.join(curr_path2, child)
-                        q.append(new_path2)
+                    children = os.listdir(curr_path)
                 except:
-                    logging.error("os.listdir(%s)" % curr_path2)
-
-            parent_path = get_parent_path(curr_path)
-            parent_level = curr_level - 1
-            logging.debug("parent_level: %s, parent_path: %s, all_level_stats[parent_level][parent_path]: %s"
-                          % (parent_level, parent_path, all_level_stats[parent_level][parent_path]))
-            logging.debug("curr_level: %s, curr_path: %s, all_level_stats[curr_level][curr_path]: %s"
-                          % (curr_level, curr_path, all_level_stats[curr_level][curr_path]))
-            add_dir_stats(
-                all_level_stats[parent_level][parent_path], all_level_stats[curr_level][curr_path])
-            continue
-
-        if (curr_phase == 2):
+                    logging.error("os.listdir(%s) failed" % curr_path)
+            self.pending[curr_path] = len(children)
+            if (len(children) == 0):
+                self.finish(curr_level, curr_path, curr_weight, 1)
+                continue
+            child_weight = curr_weight / len(children)
+            for child in children:
+                st.append((curr_level + 1, os.path.join(curr_path, child),
+                           curr_path, child_weight))
+
+    def finish(self, level, path, weight, scanned):
+        while (True):
+            dir_stats = self.all_level_stats[level][path]
+            if (level < self.dir_levels):
+                set_dir_ratios(dir_stats)
+            if (self.snapshot_writer is not None):
+                self.snapshot_writer.add_dir(self.target_dir, level, path, dir_stats)
+                self.snapshot_writer.add_progress(scanned, weight)
+            parent_path = self.parents[path]
+            if (parent_path is None):
+                self.finished = True
+                return
+            logging.debug("parent_path: %s, curr_level: %s, curr_path: %s, dir_stats: %s"
+                          % (parent_path, level, path, dir_stats))
+            add_dir_stats(self.all_level_stats[level - 1][parent_path], dir_stats)
+            self.pending[parent_path] = self.pending[parent_path] - 1
+            if (self.pending[parent_path] > 0):
+                return
+            # the parent's own entry was scanned by expand(), and its weight
+            # was handed down to the children
+            (level, path, weight, scanned) = (level - 1, parent_path, 0.0, 1)
+
+
+class ScanPool(object):
+    """A fixed set of worker threads shared by all the volumes. Units are
+    handed out round-robin among the volumes, never more than workers at once.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.running = 0
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        for i in range(workers):
+            t = threading.Thread(target=self.work)
+            t.daemon = True
+            t.start()
+
+    def work(self):
+        while (True):
+            (scan, unit) = self.tasks.get()
+            (level, path, dir_stats, weight) = unit
+            scanned = 0
             try:
-                stat = os.stat(curr_path)
+                scanned = collect_tree_stats(path, dir_stats)
             except:
-                logging.error("os.stat(%s) failed" % curr_path)
-                continue
-            logging.debug("phase 2, curr_path: %s, stat: %s, all_level_stats[curr_level][curr_path]: %s" % (
-                curr_path, stat, all_level_stats[curr_level][curr_path]))
-            size = stat.st_size
-            mtime = stat.st_mtime
-            atime = stat.st_atime
-            all_level_stats[curr_level][curr_path][COUNT] = all_level_stats[curr_level][curr_path][COUNT] + 1
-            all_level_stats[curr_level][curr_path][SIZE] = all_level_stats[curr_level][curr_path][SIZE] + size
-            if (size >= VALID_SIZE):
-                key = "%s#%s" % (COUNT, VALID_SIZE_STR)
-                all_level_stats[curr_level][curr_path][key] = all_level_stats[curr_level][curr_path][key] + 1
-                key = "%s#%s" % (SIZE, VALID_SIZE_STR)
-                all_level_stats[curr_level][curr_path][key] = all_level_stats[curr_level][curr_path][key] + size
-                for policy in tiering_policies:
-                    if ((policy[1] == MTIME and is_timestamp_cold(mtime, int(policy[0])))
-                            or (policy[1] == ATIME and is_timestamp_cold(atime, int(policy[0])))):
-                        key = "%s#%s#%s#%s" % (
-                            policy[1], policy[0], COUNT, VALID_SIZE_STR)
-                        all_level_stats[curr_level][curr_path][key] = all_level_stats[curr_level][curr_path][key] + 1
-                        key = "%s#%s#%s#%s" % (
-                            policy[1], policy[0], SIZE, VALID_SIZE_STR)
-                        all_level_stats[curr_level][curr_path][key] = all_level_stats[curr_level][curr_path][key] + size
-            all_level_stats[curr_level][curr_path]["%s#%s" % (COUNT_RATIO, VALID_SIZE_STR)] = get_ratio(
-                all_level_stats[curr_level][curr_path]["%s#%s" % (COUNT, VALID_SIZE_STR)], all_level_stats[curr_level][curr_path][COUNT])
-            all_level_stats[curr_level][curr_path]["%s#%s" % (SIZE_RATIO, VALID_SIZE_STR)] = get_ratio(
-                all_level_stats[curr_level][curr_path]["%s#%s" % (SIZE, VALID_SIZE_STR)], all_level_stats[curr_level][curr_path][SIZE])
-            for policy in tiering_policies:
-                all_level_stats[curr_level][curr_path]["%s#%s#%s#%s" % (policy[1], policy[0], COUNT_RATIO, VALID_SIZE_STR)] = get_ratio(
-                    all_level_stats[curr_level][curr_path]["%s#%s#%s#%s" % (policy[1], policy[0], COUNT, VALID_SIZE_STR)], all_level_stats[curr_level][curr_path]["%s#%s" % (COUNT, VALID_SIZE_STR)])
-                all_level_stats[curr_level][curr_path]["%s#%s#%s#%s" % (policy[1], policy[0], SIZE_RATIO, VALID_SIZE_STR)] = get_ratio(
-                    all_level_stats[curr_level][curr_path]["%s#%s#%s#%s" % (policy[1], policy[0], SIZE, VALID_SIZE_STR)], all_level_stats[curr_level][curr_path]["%s#%s" % (SIZE, VALID_SIZE_STR)])
-            parent_path = get_parent_path(curr_path)
-            parent_level = curr_level - 1
-            if (len(st) > 0):
-                logging.debug("parent_level: %s, parent_path: %s, all_level_stats[parent_level][parent_path]: %s"
-                              % (parent_level, parent_path, all_level_stats[parent_level][parent_path]))
-                logging.debug("curr_level: %s, curr_path: %s, all_level_stats[curr_level][curr_path]: %s"
-                              % (curr_level, curr_path, all_level_stats[curr_level][curr_path]))
-                add_dir_stats(
-                    all_level_stats[parent_level][parent_path], all_level_stats[curr_level][curr_path])
-
-    result = rank_dir_stats(all_level_stats, top_n, sort_key)
+                logging.exception("collect_tree_stats(%s) failed" % path)
+            self.results.put((scan, unit, scanned))
+
+    def schedule(self, scans):
+        submitted = True
+        while (submitted and self.running < self.workers):
+            submitted = False
+            for scan in scans:
+                if (self.running >= self.workers):
+                    break
+                if (len(scan.units) > 0 and scan.running < scan.max_workers):
+                    scan.running = scan.running + 1
+                    self.running = self.running + 1
+                    self.tasks.put((scan, scan.units.popleft()))
+                    submitted = True
+
+    def wait_one(self, timeout):
+        """Finish one unit, return False if none is done within timeout"""
+        try:
+            (scan, unit, scanned) = self.results.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        scan.running = scan.running - 1
+        self.running = self.running - 1
+        (level, path, dir_stats, weight) = unit
+        scan.finish(level, path, weight, scanned)
+        return True
+
+
+def get_volumes_cold_ratio_rank(target_dirs, tiering_policies, dir_levels=3, top_n=2, sort_key=SIZE,
+                                snapshot_writer=None, workers=1, root_workers=0):
+    if (root_workers <= 0 or root_workers > workers):
+        root_workers = workers
+    pool = ScanPool(workers)
+    scans = []
+    for target_dir in target_dirs:
+        scan = VolumeScan(target_dir, dir_levels, root_workers, snapshot_writer)
+        scans.append(scan)
+        # start scanning the expanded volumes while expanding the next one
+        scan.expand()
+        pool.schedule(scans)
+
+    while (pool.running > 0):
+        if (not pool.wait_one(1)):
+            # nothing finished, still give the snapshot a chance
+            if (snapshot_writer is not None):
+                snapshot_writer.add_progress(0, 0.0)
+            continue
+        pool.schedule(scans)
+
+    if (snapshot_writer is not None):
+        snapshot_writer.write()
+    result = OrderedDict()
+    for scan in scans:
+        result[scan.target_dir] = rank_dir_stats(scan.all_level_stats, top_n, sort_key)
+    if (len(scans) == 1):
+        result = result[scans[0].target_dir]
+    result = json.dumps(result, indent=4)
     logging.info(result)
     return result
 
 
+def get_volume_cold_ratio_rank(target_dir, tiering_policies, dir_levels=3, top_n=2, sort_key=SIZE, snapshot_writer=None):
+    return get_volumes_cold_ratio_rank([target_dir], tiering_policies, dir_levels, top_n, sort_key, snapshot_writer)
+
+
 if __name__ == "__main__":
     parser = OptionParser("Usage (-h for help): %prog [options]")
-    parser.add_option("--target_dir", dest="target_dir",
-                      help="target directory to start data coldness analysis, default is current folder ./", default="./")
+    parser.add_option("--target_dir", dest="target_dirs", action="append",
+                      help="target directory to start data coldness analysis, default is current folder ./. Repeat it to scan several directories in one run, the result is keyed by directory", default=None)
     parser.add_option("--dir_levels", dest="dir_levels",
                       help="levels of directories to print out, default is 3", default=3)
     parser.add_option("--tiering_policies", dest="tiering_policies",
@@ -386,15 +594,31 @@ if __name__ == "__main__":
                       help="print top N of the tiering policies of each dir level, default is 2", default=2)
     parser.add_option("--sort_key", dest="sort_key",
                       help="sort the rank by key. default is Size. Chosen from %s of data >= 64KB" % SORT_KEYS, default=SIZE)
+    parser.add_option("--snapshot_file", dest="snapshot_file",
+                      help="periodically write the partial rank of finished directories to this file while scanning, default is disabled", default=None)
+    parser.add_option("--snapshot_interval", dest="snapshot_interval",
+                      help="seconds between two snapshots of the partial rank, default is 60", default=60)
+    parser.add_option("--workers", dest="workers",
+                      help="number of scanning threads shared by all target directories, default is 1", default=1)
+    parser.add_option("--root_workers", dest="root_workers",
+                      help="max scanning threads working on one target directory at a time, default is 0 (no limit other than --workers)", default=0)
     options, args = parser.parse_args()
     message = ''
 
     try:
         options.dir_levels = int(options.dir_levels)
         options.top_n = int(options.top_n)
+        options.snapshot_interval = float(options.snapshot_interval)
+        options.workers = int(options.workers)
+        options.root_workers = int(options.root_workers)
     except:
-        message = "parse options.dir_levels:%s and options.top_n:%s to int failed" % (
-            options.dir_levels, options.top_n)
+        message = "parse options.dir_levels:%s, options.top_n:%s, options.snapshot_interval:%s, options.workers:%s and options.root_workers:%s to number failed" % (
+            options.dir_levels, options.top_n, options.snapshot_interval, options.workers, options.root_workers)
+        logging.error(message)
+        print(message)
+        sys.exit(1)
+    if (options.workers < 1):
+        message = "options.workers:%s should be at least 1" % options.workers
         logging.error(message)
         print(message)
         sys.exit(1)
@@ -407,17 +631,23 @@ if __name__ == "__main__":
         print(message)
         sys.exit(1)
 
-    if (not os.path.exists(options.target_dir)):
-        message = "options.target_dir:%s doesn't exist" % options.target_dir
-        logging.error(message)
-        print(message)
-        sys.exit(1)
-    if (not os.path.isdir(options.target_dir)):
-        message = "options.target_dir:%s is not a directory" % options.target_dir
-        logging.error(message)
-        print(message)
-        sys.exit(1)
-    options.target_dir = os.path.abspath(options.target_dir)
+    if (not options.target_dirs):
+        options.target_dirs = ["./"]
+    target_dirs = []
+    for target_dir in options.target_dirs:
+        if (not os.path.exists(target_dir)):
+            message = "options.target_dir:%s doesn't exist" % target_dir
+            logging.error(message)
+            print(message)
+            sys.exit(1)
+        if (not os.path.isdir(target_dir)):
+            message = "options.target_dir:%s is not a directory" % target_dir
+            logging.error(message)
+            print(message)
+            sys.exit(1)
+        target_dir = os.path.abspath(target_dir)
+        if (not target_dir in target_dirs):
+            target_dirs.append(target_dir)
 
     if (not options.sort_key in SORT_KEYS):
         message = "options.sort_key:%s is not in set:%s" % (
@@ -426,6 +656,12 @@ if __name__ == "__main__":
         print(message)
         sys.exit(1)
 
-    message = get_volume_cold_ratio_rank(
-        options.target_dir, tiering_policies, options.dir_levels, options.top_n, options.sort_key)
+    snapshot_writer = None
+    if (options.snapshot_file):
+        snapshot_writer = RankSnapshotWriter(
+            os.path.abspath(options.snapshot_file), options.snapshot_interval, options.top_n, options.sort_key)
+
+    message = get_volumes_cold_ratio_rank(
+        target_dirs, tiering_policies, options.dir_levels, options.top_n, options.sort_key, snapshot_writer,
+        options.workers, options.root_workers)
     print(message)
@@ -0,0 +1,294 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark nasiostat against a synthetic /proc/self/mountstats
+"""
+
+from __future__ import print_function
+
+__copyright__ = """
+Copyright (C) 2020, Alibaba Group Holding Limited
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 2 as
+published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+Nfs3Ops = [
+    'NULL', 'GETATTR', 'SETATTR', 'LOOKUP', 'ACCESS', 'READLINK', 'READ',
+    'WRITE', 'CREATE', 'MKDIR', 'SYMLINK', 'MKNOD', 'REMOVE', 'RMDIR',
+    'RENAME', 'LINK', 'READDIR', 'READDIRPLUS', 'FSSTAT', 'FSINFO',
+    'PATHCONF', 'COMMIT'
+]
+
+
+def load_nasiostat():
+    """nasiostat has no .py suffix, load it by path
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nasiostat')
+    try:
+        from importlib.machinery import SourceFileLoader
+        return SourceFileLoader('nasiostat', path).load_module()
+    except ImportError:
+        import imp
+        return imp.load_source('nasiostat', path)
+
+
+def fs_address(fs):
+    return '10.0.%d.%d' % (fs // 250, fs % 250 + 1)
+
+
+def make_mount(i, tick, fs, nconnect=1):
+    """Return the mountstats text of the i-th synthetic NFSv3 mount, a
+    mount of file system fs over nconnect connections, with counters
+    grown for the given tick
+    """
+    n = tick * (fs % 7 + 1)
+    lines = [
+        'device fs-%d.nas.aliyuncs.com:/ mounted on /mnt/nas%d with fstype nfs statvers=1.1' % (fs, i),
+        '\topts:\trw,vers=3,rsize=1048576,wsize=1048576,namlen=255,hard,noresvport,proto=tcp,'
+        'timeo=600,retrans=2,sec=sys,mountvers=3,mountproto=tcp,local_lock=all,addr=%s' % fs_address(fs),
+        '\tage:\t%d' % (86400 + tick),
+        '\tcaps:\tcaps=0x3fc7,wtmult=4096,dtsize=4096,bsize=0,namlen=255',
+        '\tsec:\tflavor=1,pseudoflavor=1',
+        '\tevents:\t' + ' '.join([str(n * (k + 1)) for k in range(27)]),
+        '\tbytes:\t' + ' '.join([str(n * 4096 * (k + 1)) for k in range(8)]),
+        '\tRPC iostats version: 1.1  p/v: 100003/3 (nfs)',
+    ]
+    for c in range(nconnect):
+        m = n * (c + 1)
+        lines.append('\txprt:\ttcp %d 1 2 0 3 %d %d 0 %d %d 65536 %d %d' % (
+            812 + c, 100 * m, 100 * m, 300 * m, 10 * m, 200 * m, 250 * m))
+    lines.append('\tper-op statistics')
+    for k in range(len(Nfs3Ops)):
+        ops = n * (k + 1)
+        lines.append('\t%12s: %d %d 0 %d %d %d %d %d 0' % (
+            Nfs3Ops[k], ops, ops, 180 * ops, 130 * ops, ops, 2 * ops, 3 * ops))
+    return '\n'.join(lines) + '\n'
+
+
+def make_mountstats(mounts, tick, filesystems=0, nconnect=1):
+    """mounts are bind mounts of the given number of file systems,
+    or each of its own file system if it is 0
+    """
+    text = ['device rootfs mounted on / with fstype rootfs\n',
+            'device proc mounted on /proc with fstype proc\n']
+    for i in range(mounts):
+        if filesystems > 0:
+            text.append(make_mount(i, tick, i % filesystems, nconnect))
+        else:
+            text.append(make_mount(i, tick, i, nconnect))
+    return ''.join(text)
+
+
+def write_mountstats(mounts, tick, filesystems=0, nconnect=1):
+    return write_text(make_mountstats(mounts, tick, filesystems, nconnect))
+
+
+def write_text(text):
+    fd, path = tempfile.mkstemp(prefix='mountstats.')
+    f = os.fdopen(fd, 'w')
+    f.write(text)
+    f.close()
+    return path
+
+
+def blocks_text(blocks):
+    """The mountstats text of the blocks of a recorded snapshot
+    """
+    text = []
+    for header, body in blocks:
+        text.append(header + '\n' + body)
+        if body and not body.endswith('\n'):
+            text.append('\n')
+    return ''.join(text)
+
+
+def check_bind_mounts(nasiostat):
+    """Bind mounts of one file system must parse as one superblock,
+    whichever of them is the last block of the file
+    """
+    first = make_mount(0, 1, 0)
+    second = make_mount(1, 1, 0)
+    for text in (first + second, second + first):
+        path = write_text(text)
+        try:
+            stats = nasiostat.parse_stats_file(path)
+        finally:
+            os.remove(path)
+        assert stats['/mnt/nas0'].superblock == stats['/mnt/nas1'].superblock, \
+            'bind mounts parsed as two superblocks'
+
+
+TaskQueues = ['xprt_backlog', 'xprt_sending', 'xprt_pending', 'none']
+
+
+def make_debugfs(path, clients, tasks, tick=0):
+    """Write a synthetic sunrpc debugfs under path: clients rpc clients,
+    the i-th one of file system i, with tasks tasks each.  Half of the
+    tasks carry over to the next tick.
+    """
+    for c in range(clients):
+        client = os.path.join(path, 'rpc_clnt', '%x' % c)
+        if not os.path.isdir(os.path.join(client, 'xprt')):
+            os.makedirs(os.path.join(client, 'xprt'))
+        f = open(os.path.join(client, 'xprt', 'info'), 'w')
+        f.write('netid: tcp\naddr:  %s\nport:  2049\nstate: 0x1b\n' % fs_address(c))
+        f.close()
+        lines = []
+        for t in range(tasks):
+            pid = t + (tick * tasks + t) // 2 if t % 2 else t + tick * tasks
+            lines.append('%5u %04x %6d 0x%x 0x%x %8d nfs_pgio_common_ops [nfs] nfsv3 %s '
+                         'a:call_status [sunrpc] q:%s' % (
+                             pid, 0x4a80, 0, c, 0x7a000000 + pid, 6000, Nfs3Ops[6 + t % 2],
+                             TaskQueues[t % len(TaskQueues)]))
+        f = open(os.path.join(client, 'tasks'), 'w')
+        f.write('\n'.join(lines) + '\n')
+        f.close()
+
+
+class NullWriter(object):
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+class Options(object):
+    def __init__(self):
+        self.which = 0
+        self.sort = False
+        self.list = sys.maxsize
+        self.show_mounts = False
+        self.writer = None
+        self.tcp = None
+        self.diagnose = False
+        self.windows = None
+
+
+def timeit(func, rounds):
+    start = time.time()
+    for i in range(rounds):
+        func()
+    return (time.time() - start) * 1000 / rounds
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [ <options> ]")
+    parser.set_defaults(mounts=1000, rounds=20, filesystems=0, nconnect=1)
+    parser.add_option('-n', '--mounts', type=int, dest='mounts', help='number of NFS mounts')
+    parser.add_option('-f', '--filesystems', type=int, dest='filesystems',
+                      help='make the mounts bind mounts of this many file systems, default is one each')
+    parser.add_option('-c', '--nconnect', type=int, dest='nconnect', help='connections of every mount')
+    parser.add_option('-r', '--rounds', type=int, dest='rounds', help='rounds of every measurement')
+    parser.add_option('--replay', dest='replay',
+                      help='use the first two snapshots of this nasiostat record file instead')
+    options, args = parser.parse_args()
+
+    nasiostat = load_nasiostat()
+    check_bind_mounts(nasiostat)
+    if options.replay:
+        snapshots = nasiostat.read_snapshots(options.replay)
+        old_file = write_text(blocks_text(next(snapshots).blocks))
+        new_file = write_text(blocks_text(next(snapshots).blocks))
+    else:
+        old_file = write_mountstats(options.mounts, 1, options.filesystems, options.nconnect)
+        new_file = write_mountstats(options.mounts, 2, options.filesystems, options.nconnect)
+    record_file = tempfile.mktemp(prefix='mountstats.record.')
+    try:
+        old = nasiostat.parse_stats_file(old_file)
+        new = nasiostat.parse_stats_file(new_file)
+        devices = nasiostat.list_nfs_mounts([], new)
+        if options.replay:
+            options.mounts = len(devices)
+            options.filesystems = len(set([new[x].export for x in devices]))
+        assert len(devices) == options.mounts
+        few = set(devices[:10])
+        old_blocks = nasiostat.read_stats_blocks(old_file)
+        new_blocks = nasiostat.read_stats_blocks(new_file)
+
+        def tick():
+            stats = nasiostat.parse_stats_file(new_file)
+            nasiostat.print_iostat_summary(old, stats, nasiostat.list_nfs_mounts([], stats), 1, Options())
+
+        def json_tick():
+            opts = Options()
+            opts.writer = writer
+            stats = nasiostat.parse_stats_file(new_file)
+            nasiostat.print_iostat_summary(old, stats, nasiostat.list_nfs_mounts([], stats), 1, opts)
+
+        def fs_tick():
+            stats = nasiostat.parse_stats_file(new_file)
+            nasiostat.print_fs_summary(old, stats, nasiostat.list_nfs_mounts([], stats), 1, Options())
+
+        def diff():
+            for device in devices:
+                new[device].compare_iostats(old[device])
+
+        def record(snapshots=2):
+            if os.path.exists(record_file):
+                os.remove(record_file)
+            recorder = nasiostat.SnapshotRecorder(record_file)
+            recorder.append(1.0, 1.0, old_blocks)
+            if snapshots > 1:
+                recorder.append(2.0, 2.0, new_blocks)
+            recorder.close()
+            return os.path.getsize(record_file)
+
+        def replay():
+            for snapshot in nasiostat.read_snapshots(record_file):
+                nasiostat.parse_stats_blocks(snapshot.blocks)
+
+        results = [
+            ('parse all mounts', timeit(lambda: nasiostat.parse_stats_file(new_file), options.rounds)),
+            ('parse 10 given mounts', timeit(lambda: nasiostat.parse_stats_file(new_file, few), options.rounds)),
+            ('list nfs mounts', timeit(lambda: nasiostat.list_nfs_mounts([], new), options.rounds)),
+            ('diff all mounts', timeit(diff, options.rounds)),
+        ]
+        first_size = record(1)
+        delta_size = record(2) - first_size
+        results.append(('record two snapshots', timeit(record, options.rounds)))
+        results.append(('replay two snapshots', timeit(replay, options.rounds)))
+        debugfs = tempfile.mkdtemp(prefix='sunrpc.')
+        try:
+            make_debugfs(debugfs, 16, 128)
+            sampler = nasiostat.RpcTaskSampler(debugfs)
+            results.append(('sample 16 x 128 rpc tasks', timeit(sampler.sample, options.rounds)))
+        finally:
+            shutil.rmtree(debugfs)
+        stdout = sys.stdout
+        sys.stdout = NullWriter()
+        try:
+            results.append(('full tick, text output', timeit(tick, options.rounds)))
+            results.append(('full tick, --fs text output', timeit(fs_tick, options.rounds)))
+            writer = nasiostat.RecordWriter('json', None, nasiostat.which_ops(0))
+            results.append(('full tick, json output', timeit(json_tick, options.rounds)))
+        finally:
+            sys.stdout = stdout
+    finally:
+        os.remove(old_file)
+        os.remove(new_file)
+        if os.path.exists(record_file):
+            os.remove(record_file)
+
+    print('%d NFS mounts of %d file systems, %d rounds' % (
+        options.mounts, options.filesystems or options.mounts, options.rounds))
+    for name, ms in results:
+        print(format(name, '<32s') + format(ms, '>10.3f') + ' ms')
+    print('record size: %d bytes the first snapshot, %d bytes every next one' % (first_size, delta_size))
+
+
+if __name__ == '__main__':
+    main()
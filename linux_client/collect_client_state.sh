@@ -41,6 +41,29 @@ function run() {
     fi
 }
 
+# Sample the RPC tasks of every rpc client once a second for $interval
+# seconds.  nasiostat next to this script samples them in one process four
+# times a second, without it fall back to counting the task states by hand.
+nasiostat=$(dirname $0)/nasiostat
+python=$(command -v python3 || command -v python)
+
+function sample_rpc_tasks() {
+    if [ -f $nasiostat ] && [ -n "$python" ]; then
+	run "$python $nasiostat --tasks 1 $interval"
+	return
+    fi
+    i=0
+    while true; do
+	[ $i = $((interval)) ] && break;
+	i=$((i+1));
+	run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/*/tasks | wc -l'
+	run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/*/tasks | grep backlog | wc -l'
+	run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/*/tasks | grep sending | wc -l'
+	run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/*/tasks | grep pending | wc -l'
+	sleep 1
+    done
+}
+
 # Basic Configuration
 run 'uname -a'
 run 'cat /etc/os-release'
@@ -80,16 +103,7 @@ if $RUN_FIO; then
 		run "nfsiostat $dir 1 $interval" '&'
 		sleep 0.1
 		run "mpstat -P ALL 1 $interval" '&'
-		i=0
-		while true; do
-		    [ $i = $((interval)) ] && break;
-		    i=$((i+1));
-		    run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/[0-9]/tasks | wc -l'
-		    run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/[0-9]/tasks | grep backlog | wc -l'
-		    run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/[0-9]/tasks | grep sending | wc -l'
-		    run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/[0-9]/tasks | grep pending | wc -l'
-		    sleep 1
-		done
+		sample_rpc_tasks
 		wait
 		echo '############################################################################' | tee -a $outfile
 	    done
@@ -104,16 +118,7 @@ else
     run "nfsiostat 1 $interval" '&'
     sleep 0.1
     run "mpstat -P ALL 1 $interval" '&'
-    i=0
-    while true; do
-        [ $i = $((interval)) ] && break;
-        i=$((i+1));
-        run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/[0-9]/tasks | wc -l'
-        run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/[0-9]/tasks | grep backlog | wc -l'
-        run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/[0-9]/tasks | grep sending | wc -l'
-        run 'cat /sys/kernel/debug/sunrpc/rpc_clnt/[0-9]/tasks | grep pending | wc -l'
-        sleep 1
-    done
+    sample_rpc_tasks
     wait
     # Final Check for Network Quality
     run 'netstat -s | grep fast   # detailed info of dropped and retransmitted packets'
@@ -18,9 +18,10 @@
 
 VERSION = '1.4'
 
-import subprocess
 import argparse
 import sys
+import os
+import select
 import string
 import httplib
 import datetime
@@ -31,6 +32,7 @@ import base64
 import hmac
 import json
 import threading
+import Queue
 import errno
 import platform
 
@@ -39,17 +41,30 @@ GENERAL_CONTACT = "NAS研发团队（钉钉群号：23110762）"
 NAS_ALIYUN_SUFFIX = ".nas.aliyuncs.com"
 MOUNT_FILENAME = "/proc/mounts"
 DEBUG_MODE = False
+# seconds between two probes of the daemon mode
+DEFAULT_INTERVAL = 60
+# seconds a probe may take before its mount is reported as blocked
+DEFAULT_STALL_TIMEOUT = 30
+# threads probing the mounts
+PROBE_THREADS = 4
+# seconds between two looks of the watchdog at the running probes
+WATCHDOG_TICK = 0.5
+# seconds an event upload to CloudMonitor may take
+CMS_TIMEOUT = 10
+# the error reported for a blocked mount, the exit status of timeout(1)
+# the probes ran under before
+STALL_STATUS = 124
 
 def abort(e, msg="请处理以上问题，然后重新运行此脚本"):
     print >> sys.stderr, msg
     sys.exit(e)
 
-def run_cmd(cmd):
-    proc = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE, shell=True)
-    output, err = proc.communicate()
-    return (proc.returncode, output)
+def monotonic():
+    """Seconds from a fixed point in the past, which unlike time.time
+    do not move when the clock is set: python 2 has no time.monotonic,
+    the elapsed time of os.times counts the ticks of the kernel
+    """
+    return os.times()[4]
 
 def get_error_code(error_num):
     extended_errorcode = errno.errorcode
@@ -75,8 +90,26 @@ def get_local_ip(domain_name, socket_num):
         abort(IOError, "%s:%d无法连通" % (domain_name, socket_num))
     return s.getsockname()[0]
 
+def is_local_ip(ip):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.bind((ip, 0))
+        return True
+    except socket.error:
+        return False
+    finally:
+        s.close()
+
+def refresh_local_ip():
+    """Resolve the local address on the first call, and again only once
+    it is no longer an address of this host
+    """
+    global LOCAL_IP
+    if LOCAL_IP is None or not is_local_ip(LOCAL_IP):
+        LOCAL_IP = get_local_ip(CMS_DOMAIN_NAME, 80)
+
 KERNEL_VERS = platform.platform()
-LOCAL_IP = get_local_ip(CMS_DOMAIN_NAME, 80)
+LOCAL_IP = None
 
 class MountParser:
     @staticmethod
@@ -149,25 +182,60 @@ class MountParser:
         return mount_info_dict
 
 
+class MountWatcher(object):
+    """Tell whether the mount table changed, as findmnt --poll does: the
+    kernel flags the mounts file with POLLERR | POLLPRI on every mount
+    and umount.  Without poll every call reports a change.
+    """
+
+    def __init__(self, filename=MOUNT_FILENAME):
+        self.poller = None
+        try:
+            self.mount_file = open(filename)
+            self.poller = select.poll()
+            self.poller.register(self.mount_file.fileno(),
+                                 select.POLLERR | select.POLLPRI)
+        except (AttributeError, IOError, OSError):
+            self.poller = None
+
+    def changed(self):
+        if self.poller is None:
+            return True
+        # the kernel reports a change to a single poll, mounts_poll
+        # clears the flag as it returns it
+        return bool(self.poller.poll(0))
+
+
 class CredentialsReader(object):
     def __init__(self, config_path):
+        self.config_path = config_path
+        self.signature = self.get_signature()
         (self.accessid, self.accesskey) = self.load_config(config_path)
 
-    def load_config(self, config_path):
+    def get_signature(self):
+        try:
+            st = os.stat(self.config_path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def read_config(self, config_path):
         accessid = None
         accesskey = None
+        config_file = open(config_path, 'r')
+        for config_line in config_file.readlines():
+            if "accessid" in config_line:
+                accessid = config_line.split('=')[1].strip()
+            elif "accesskey" in config_line:
+                accesskey = config_line.split('=')[1].strip()
+        config_file.close()
+        if not accessid or not accesskey:
+            raise ValueError
+        return (accessid, accesskey)
+
+    def load_config(self, config_path):
         try:
-            config_file = open(config_path, 'r')
-            for config_line in config_file.readlines():
-                if "accessid" in config_line:
-                    accessid = config_line.split('=')[1].strip()
-                elif "accesskey" in config_line:
-                    accesskey = config_line.split('=')[1].strip()
-            config_file.close()
-            if not accessid or not accesskey:
-                raise ValueError
-            else:
-                return (accessid, accesskey)
+            return self.read_config(config_path)
         except Exception as e:
             abort(e, """
             请确认配置文件%s使用以下格式记录密钥信息：
@@ -175,6 +243,21 @@ class CredentialsReader(object):
             accesskey = ACCESS_KEY
             """ % config_path)
 
+    def refresh(self):
+        """Read the config file again if it changed since it was read,
+        the credentials read before are kept if it is not valid
+        """
+        signature = self.get_signature()
+        if signature == self.signature:
+            return
+        self.signature = signature
+        try:
+            (self.accessid, self.accesskey) = self.read_config(
+                self.config_path)
+        except Exception:
+            print >> sys.stderr, "配置文件%s格式异常，继续使用之前的密钥" % (
+                self.config_path)
+
     def get_accessid(self):
         return self.accessid
 
@@ -275,7 +358,7 @@ class CloudMonitorHandler(object):
         body_dict = self.get_body_dict()
         body_str = json.dumps([body_dict])
         header_dict = self.get_header_dict(body_str)
-        conn = httplib.HTTPSConnection(self.http_host)
+        conn = httplib.HTTPSConnection(self.http_host, timeout=CMS_TIMEOUT)
         conn.request(self.method, self.http_path, body_str, header_dict)
         res = conn.getresponse()
         print body_dict["time"], "Request:", body_str, "Response:", res.read()
@@ -289,25 +372,29 @@ class CongestionChecker(object):
         self.server = server
         self.path = path
         self.mountpoint = mountpoint
-        self.cloud_monitor_handler = CloudMonitorHandler(
-            cred_reader.get_accessid(),
-            cred_reader.get_accesskey(),
-            "NasCongestion",
-            "",
-            group_id
-        )
+        self.cred_reader = cred_reader
+        self.group_id = group_id
+        # set by ProbePool
+        self.probing = False
+        self.started = None
+        self.stalled = False
+
+    def probe(self):
+        """Return 0, or the errno of statvfs on the mount point
+        """
+        try:
+            os.statvfs(self.mountpoint)
+        except OSError as e:
+            return e.errno
+        return 0
 
-    def run(self):
-        (which_status, which_output) = run_cmd("which timeout")
-        if which_status != 0:
-            abort(e, "timeout工具缺失，请联系%s" % GENERAL_CONTACT)
-        check_cmd = "stat -f %s" % self.mountpoint
-        cmd = 'timeout 300s bash -c "%s"' % check_cmd
-        (stat_status, stat_output) = run_cmd(cmd)
-        if stat_status != 0 or DEBUG_MODE:
-            self.report(stat_status)
+    def report_async(self, stat_status):
+        # not a daemon thread, the event is sent before the script exits
+        threading.Thread(target=self.report, args=(stat_status,)).start()
 
     def report(self, stat_status):
+        # the reports of a mount may run at the same time, e.g. the stall
+        # and the error statvfs returns after it, each has its handler
         content = {
             'mount_target': "%s:%s" % (self.server, self.path),
             'kernel_version': KERNEL_VERS,
@@ -315,10 +402,87 @@ class CongestionChecker(object):
             'local_dir': self.mountpoint,
             'error_type': get_error_code(stat_status)
         }
-        self.cloud_monitor_handler.update_content(
-            json.dumps([content])
+        cloud_monitor_handler = CloudMonitorHandler(
+            self.cred_reader.get_accessid(),
+            self.cred_reader.get_accesskey(),
+            "NasCongestion",
+            json.dumps([content]),
+            self.group_id
         )
-        self.cloud_monitor_handler.report_event()
+        cloud_monitor_handler.report_event()
+
+
+class ProbePool(object):
+    """Probe the mounts with statvfs on a few reusable threads.  A probe
+    running longer than the stall timeout is reported by the watchdog.
+    Its thread, stuck in D state on the blocked mount, cannot be stopped:
+    it is parked, a new thread takes its place and it ends once statvfs
+    returns.  A mount is not probed again while its probe runs, so a
+    blocked mount holds at most one thread.
+    """
+
+    def __init__(self, size, stall_timeout):
+        self.stall_timeout = stall_timeout
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.running = set()
+        for i in range(size):
+            self.add_thread()
+
+    def add_thread(self):
+        t = threading.Thread(target=self.work)
+        t.daemon = True
+        t.start()
+
+    def submit(self, checker):
+        with self.lock:
+            if checker.probing:
+                return
+            checker.probing = True
+        self.queue.put(checker)
+
+    def work(self):
+        while True:
+            checker = self.queue.get()
+            with self.lock:
+                checker.started = monotonic()
+                self.running.add(checker)
+            stat_status = checker.probe()
+            with self.lock:
+                self.running.discard(checker)
+                checker.probing = False
+                stalled = checker.stalled
+                checker.stalled = False
+            if stat_status != 0 or DEBUG_MODE:
+                checker.report_async(stat_status)
+            elif stalled:
+                print "%s恢复访问" % checker.mountpoint
+            if stalled:
+                # parked, another thread took its place
+                return
+
+    def watchdog(self):
+        now = monotonic()
+        stalled = []
+        with self.lock:
+            for checker in self.running:
+                if not checker.stalled and \
+                   now - checker.started >= self.stall_timeout:
+                    checker.stalled = True
+                    stalled.append(checker)
+        for checker in stalled:
+            self.add_thread()
+            checker.report_async(STALL_STATUS)
+
+    def busy(self, checkers):
+        """Tell whether any of the checkers has a probe queued or running
+        which did not stall
+        """
+        with self.lock:
+            for checker in checkers:
+                if checker.probing and not checker.stalled:
+                    return True
+        return False
 
 
 class NasMonitor(object):
@@ -333,37 +497,114 @@ class NasMonitor(object):
                              required=False,
                              default="/etc/.cmscredentials",
                              help="密钥配置文件的路径")
+        _parser.add_argument("-d", "--daemon", action="store_true",
+                             help="常驻运行，每隔--interval秒检查一次，"
+                                  "代替crontab每分钟执行")
+        _parser.add_argument("-i", "--interval", type=float,
+                             default=DEFAULT_INTERVAL,
+                             help="常驻运行时两次检查的间隔秒数，默认%d" % (
+                                 DEFAULT_INTERVAL))
+        _parser.add_argument("-t", "--stall_timeout", type=float,
+                             default=DEFAULT_STALL_TIMEOUT,
+                             help="访问挂载点超过此秒数未返回即报告阻塞，"
+                                  "默认%d" % DEFAULT_STALL_TIMEOUT)
         global DEBUG_MODE
         user_options = _parser.parse_args()
-        group_id = user_options.group_id
+        if user_options.interval <= 0:
+            _parser.error("--interval必须大于0")
+        if user_options.stall_timeout <= 0:
+            _parser.error("--stall_timeout必须大于0")
+        self.group_id = user_options.group_id
         DEBUG_MODE = user_options.debug
+        self.daemon = user_options.daemon
+        self.interval = user_options.interval
         credentials_path = user_options.credentials_path
 
+        refresh_local_ip()
+        self.pool = ProbePool(PROBE_THREADS, user_options.stall_timeout)
         self.check_list = []
-        cred_reader = CredentialsReader(credentials_path)
+        self.cred_reader = CredentialsReader(credentials_path)
+        self.load_check_list()
+
+    def load_check_list(self):
+        """List the NAS mounts, the checkers of the mounts listed before
+        are kept with their running probes
+        """
+        checkers = {}
+        for checker in self.check_list:
+            key = (checker.server, checker.path, checker.mountpoint)
+            checkers[key] = checker
 
         # mount_info_dict is a dict for /proc/mounts, with the key as
         # the server hostname, and the value as a list of (mountpoint,
         # path, systype, opt_str), with all tuple elements as strings
         mount_info_dict = MountParser.read_mount_info()
 
+        self.check_list = []
         for server, mount_tuple_list in mount_info_dict.items():
             if not MountParser.is_aliyun_nas_server(server):
                 continue
             for mount_tuple in mount_tuple_list:
                 (mountpoint, path, systype, opt_str) = mount_tuple
-                self.check_list.append(
-                    CongestionChecker(server, path, mountpoint,
-                                      cred_reader, group_id))
+                checker = checkers.get((server, path, mountpoint))
+                if checker is None:
+                    checker = CongestionChecker(server, path, mountpoint,
+                                                self.cred_reader,
+                                                self.group_id)
+                self.check_list.append(checker)
+
+    def retry_later(self, refresh, msg):
+        """Run a refresh of the daemon, which aborts when it fails, and
+        tell whether it succeeded.  After a failure what was read before
+        is kept and the refresh is tried again at the next check.
+        """
+        try:
+            refresh()
+            return True
+        except SystemExit:
+            print >> sys.stderr, msg
+            return False
 
     def run(self):
-        threads = []
+        if self.daemon:
+            self.run_daemon()
+            return
         for checker in self.check_list:
-            t = threading.Thread(target=checker.run)
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+            self.pool.submit(checker)
+        while self.pool.busy(self.check_list):
+            time.sleep(WATCHDOG_TICK)
+            self.pool.watchdog()
+
+    def run_daemon(self):
+        """Check the mounts every interval seconds, and the probes
+        running every WATCHDOG_TICK.  The mounts are only listed again
+        when the mount table changed, the credentials read again when
+        their file changed and the local address resolved again when it
+        is gone.
+        """
+        watcher = MountWatcher()
+        # a change of the mount table is reported once, it is kept until
+        # the mounts are listed
+        mounts_changed = False
+        deadline = monotonic()
+        while True:
+            now = monotonic()
+            if now >= deadline:
+                mounts_changed = watcher.changed() or mounts_changed
+                if mounts_changed:
+                    mounts_changed = not self.retry_later(
+                        self.load_check_list, "继续检查之前的挂载点")
+                self.cred_reader.refresh()
+                self.retry_later(refresh_local_ip,
+                                 "继续使用之前的本机地址%s" % LOCAL_IP)
+                for checker in self.check_list:
+                    self.pool.submit(checker)
+                deadline += self.interval
+                if deadline < now:
+                    # the checks fell behind, e.g. the script was stopped
+                    deadline = now + self.interval
+            self.pool.watchdog()
+            time.sleep(max(0, min(WATCHDOG_TICK, deadline - monotonic())))
 
 
 if __name__ == '__main__':